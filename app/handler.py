@@ -1,32 +1,313 @@
 import os
-import json
-import uuid
+import base64
+import binascii
+import itertools
+import time
+import random
 import logging
 import ssl
-import urllib.request
-from urllib.error import HTTPError, URLError
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import orjson
+import urllib3
 from botocore.exceptions import ClientError
 
-# AWS clients
-SSM = boto3.client("ssm")
-DDB = boto3.client("dynamodb")
+# AWS clients, created on first use by _get_client (or at import under
+# provisioned concurrency, see below). Importing boto3 and building clients is
+# the bulk of cold-start time, and requests rejected before any AWS call
+# (malformed bodies) shouldn't pay for it.
+_CLIENTS: dict = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# boto3 TypeSerializer for DynamoDB items; imported on the first write.
+_SERIALIZER = None
+
+# Background workers for I/O that can overlap with the handler's own work.
+_POOL = ThreadPoolExecutor(max_workers=2)
+
+# How long the handler waits for the background DynamoDB write before
+# returning. Lambda freezes the container once the response is sent, so an
+# unfinished write only resumes on the next invocation.
+_DDB_WRITE_WAIT = 0.5
+
+# BatchWriteItem accepts at most 25 put requests per call.
+_BATCH_WRITE_SIZE = 25
+_BATCH_WRITE_ATTEMPTS = 5
+_BATCH_WRITE_BACKOFF_BASE = 0.05
+# Batch triggers: a record is only started if at least _RECORD_MIN_TIME
+# seconds are left for it, after keeping _BATCH_WRITE_RESERVE seconds back
+# for the final BatchWriteItem.
+_RECORD_MIN_TIME = 3.0
+_BATCH_WRITE_RESERVE = 2.0
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_HOST = "api.openai.com"
+OPENAI_PATH = "/v1/chat/completions"
 MODEL = "gpt-4o-mini"  # small & cheap model; change if needed
+MAX_TOKENS = 1024  # caps output size (and latency) of a single plan
+
+# User prompt, filled in per request with str.format (literal braces doubled).
+_PROMPT_TEMPLATE = (
+    "Build a 1-day meal plan at about {calories} kcal and "
+    "{protein_g} g protein. Avoid these foods: {dislikes}. "
+    "Budget: ${budget} per day. "
+    "Return JSON with keys: "
+    "meals (array of {{name, ingredients, macros:{{kcal,protein,carbs,fat}}, prep}}), "
+    "totals ({{kcal,protein,carbs,fat}}), "
+    "shopping_list (array of strings), "
+    "notes (string)."
+)
+
+# OpenAI retry policy: bounded attempts with exponential backoff + full jitter,
+# only for rate limits / transient server errors, all inside one deadline. The
+# deadline is at most _OPENAI_DEADLINE per call, and never later than the
+# invocation's remaining time minus _DEADLINE_MARGIN (kept back for the
+# DynamoDB write wait and returning the response).
+_OPENAI_ATTEMPTS = 3
+_OPENAI_DEADLINE = 12.0
+_DEADLINE_MARGIN = _DDB_WRITE_WAIT + 0.5
+# Separate connect/read budgets: an unreachable endpoint fails within 2s,
+# while a slow but healthy generation still gets the full read window.
+_OPENAI_CONNECT_TIMEOUT = 2.0
+_OPENAI_READ_TIMEOUT = 12.0
+_OPENAI_BACKOFF_BASE = 1.0
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Circuit breaker around OpenAI, per container. After _BREAKER_THRESHOLD
+# consecutive transient failures (429/5xx, connection errors) it opens for
+# _BREAKER_COOLDOWN seconds and requests go straight to the fallback plan; the
+# first call after that is a trial (half-open) that either closes it again or
+# re-opens it.
+_BREAKER = {"fails": 0, "open_until": 0.0}
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN = 30.0
+
+# Chat completion request body with everything but the user prompt encoded
+# once per container. The prompt is JSON-encoded per call and spliced in
+# between _BODY_HEAD and _BODY_TAIL.
+_PROMPT_PLACEHOLDER = "__PROMPT__"
+_BODY_HEAD, _BODY_TAIL = (
+    orjson.dumps(
+        {
+            "model": MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a nutrition planner. "
+                        "You ALWAYS respond with valid JSON only."
+                    ),
+                },
+                {
+                    "role": "user",
+                    "content": _PROMPT_PLACEHOLDER,
+                },
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.4,
+            "max_tokens": MAX_TOKENS,
+        }
+    )
+    .split(orjson.dumps(_PROMPT_PLACEHOLDER))
+)
+
+# Decrypted SSM values survive across warm invocations of the same container.
+# Entries are (fetched_at, value) and expire after _SECRET_TTL seconds so a
+# rotated key is picked up without a redeploy.
+_SECRET_CACHE: dict[str, tuple[float, str]] = {}
+_SECRET_TTL = 300
+
+# Pooled HTTPS connection to OpenAI, kept at module scope so warm invocations
+# reuse the TLS session instead of handshaking on every call. Retries are
+# disabled here; failures are handled in call_openai_or_fallback.
+# The SSL context (and its CA bundle) is loaded once and shared by every
+# connection the pool opens, rather than rebuilt per new connection.
+_SSL_CTX = ssl.create_default_context()
+_HTTP = urllib3.HTTPSConnectionPool(
+    OPENAI_HOST,
+    maxsize=4,
+    ssl_context=_SSL_CTX,
+    timeout=urllib3.Timeout(
+        connect=_OPENAI_CONNECT_TIMEOUT,
+        read=_OPENAI_READ_TIMEOUT,
+    ),
+    retries=False,
+)
+
+
+def _get_client(service: str):
+    """
+    Shared boto3 client for service, imported and built on first call.
+    Uses keep-alive sockets so warm invocations reuse the connection, plus
+    short timeouts and bounded standard-mode retries.
+    """
+    client = _CLIENTS.get(service)
+    if client is None:
+        # boto3's default session isn't thread-safe, and clients are also
+        # requested from _POOL workers.
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(service)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+
+                client = boto3.client(
+                    service,
+                    config=Config(
+                        tcp_keepalive=True,
+                        retries={"mode": "standard", "max_attempts": 3},
+                        connect_timeout=1,
+                        read_timeout=3,
+                        max_pool_connections=10,
+                    ),
+                )
+                _CLIENTS[service] = client
+    return client
+
+
+def _get_serializer():
+    """
+    Shared boto3 TypeSerializer, imported and built on first call.
+    """
+    global _SERIALIZER
+    if _SERIALIZER is None:
+        from boto3.dynamodb.types import TypeSerializer
+
+        _SERIALIZER = TypeSerializer()
+    return _SERIALIZER
+
+
+# Provisioned concurrency runs the init phase before any traffic arrives, so
+# there the boto3 import and client setup belong at import time rather than
+# on each environment's first request. On-demand environments stay lazy.
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    _get_client("ssm")
+    _get_client("dynamodb")
+    _get_serializer()
 
 
 def get_secret(param_name: str) -> str:
     """
     Get OpenAI API key from SSM Parameter Store.
     The Lambda environment variable OPENAI_PARAM holds the parameter name.
+    Values are cached per container for _SECRET_TTL seconds.
+    """
+    now = time.monotonic()
+    cached = _SECRET_CACHE.get(param_name)
+    if cached is not None and now - cached[0] < _SECRET_TTL:
+        return cached[1]
+
+    resp = _get_client("ssm").get_parameter(Name=param_name, WithDecryption=True)
+    value = resp["Parameter"]["Value"]
+    _SECRET_CACHE[param_name] = (now, value)
+    return value
+
+
+# Static part of the fallback plan, built once per container. Only the totals
+# depend on the request, so they are filled in per call.
+_FALLBACK_SKELETON = {
+    "meals": [
+        {
+            "name": "Fallback Breakfast",
+            "ingredients": [
+                "rolled oats (80g)",
+                "whey protein (1 scoop)",
+                "banana (1 medium)",
+                "water or low-fat milk",
+            ],
+            "macros": {
+                "kcal": 500,
+                "protein": 40,
+                "carbs": 65,
+                "fat": 8,
+            },
+            "prep": (
+                "Microwave oats with water or milk, then stir in "
+                "whey protein and sliced banana."
+            ),
+        },
+        {
+            "name": "Fallback Lunch",
+            "ingredients": [
+                "chicken breast (150g)",
+                "rice (100g dry)",
+                "mixed veggies (frozen, 100g)",
+            ],
+            "macros": {
+                "kcal": 650,
+                "protein": 55,
+                "carbs": 75,
+                "fat": 12,
+            },
+            "prep": (
+                "Grill or pan-cook chicken, cook rice, heat veggies. "
+                "Serve together and season to taste."
+            ),
+        },
+        {
+            "name": "Fallback Dinner",
+            "ingredients": [
+                "93% lean ground turkey (150g)",
+                "whole wheat pasta (90g dry)",
+                "tomato sauce (100g)",
+            ],
+            "macros": {
+                "kcal": 700,
+                "protein": 55,
+                "carbs": 80,
+                "fat": 16,
+            },
+            "prep": (
+                "Brown turkey in a pan, boil pasta, add tomato sauce. "
+                "Combine and season with salt, pepper, and herbs."
+            ),
+        },
+    ],
+    "shopping_list": [
+        "rolled oats",
+        "whey protein",
+        "bananas",
+        "chicken breast",
+        "rice",
+        "mixed frozen veggies",
+        "93% lean ground turkey",
+        "whole wheat pasta",
+        "tomato sauce",
+    ],
+    "notes": (
+        "This is a static fallback plan used when the OpenAI API call "
+        "fails or is rate limited (HTTP 429). Once your OpenAI quota is "
+        "available again, the API will start returning fully "
+        "AI-generated plans instead."
+    ),
+}
+
+# JSON of the skeleton without its closing brace; the per-call totals are
+# appended so the fallback path only has to encode a 4-key dict.
+_FALLBACK_JSON_PREFIX = orjson.dumps(_FALLBACK_SKELETON).decode("utf-8")[:-1]
+
+
+# Upper bounds for requested targets. Anything larger is clamped, which also
+# keeps the totals inside orjson's 64-bit integer range.
+MAX_CALORIES = 10000
+MAX_PROTEIN_G = 1000
+
+
+def _fallback_totals(calories: int, protein_g: int) -> dict:
+    """
+    Rough scaling of the fallback totals so it looks responsive.
     """
-    resp = SSM.get_parameter(Name=param_name, WithDecryption=True)
-    return resp["Parameter"]["Value"]
+    calories = int(min(max(calories, 0), MAX_CALORIES)) or 2000
+    protein_g = int(min(max(protein_g, 0), MAX_PROTEIN_G)) or 180
+    return {
+        "kcal": calories,
+        "protein": protein_g,
+        "carbs": 220 * calories // 2000,
+        "fat": 50 * calories // 2000,
+    }
 
 
 def build_fallback_plan(calories: int, protein_g: int) -> dict:
@@ -34,153 +315,351 @@ def build_fallback_plan(calories: int, protein_g: int) -> dict:
     Simple static fallback plan used when OpenAI fails or rate limits.
     Adjusts totals a bit based on requested calories/protein.
     """
-    base_totals = {"kcal": 2000, "protein": 180, "carbs": 220, "fat": 50}
+    return {**_FALLBACK_SKELETON, "totals": _fallback_totals(calories, protein_g)}
 
-    # Rough scaling so it looks responsive
-    scale = calories / 2000 if calories else 1.0
-    protein_scale = protein_g / 180 if protein_g else 1.0
 
-    totals = {
-        "kcal": int(base_totals["kcal"] * scale),
-        "protein": int(base_totals["protein"] * protein_scale),
-        "carbs": int(base_totals["carbs"] * scale),
-        "fat": int(base_totals["fat"] * scale),
-    }
+def _fallback_plan_json(calories: int, protein_g: int) -> str:
+    """
+    JSON string equivalent of build_fallback_plan(), reusing the pre-encoded
+    skeleton.
+    """
+    totals = orjson.dumps(_fallback_totals(calories, protein_g)).decode("utf-8")
+    return _FALLBACK_JSON_PREFIX + ',"totals":' + totals + "}"
 
-    plan = {
-        "meals": [
-            {
-                "name": "Fallback Breakfast",
-                "ingredients": [
-                    "rolled oats (80g)",
-                    "whey protein (1 scoop)",
-                    "banana (1 medium)",
-                    "water or low-fat milk",
-                ],
-                "macros": {
-                    "kcal": 500,
-                    "protein": 40,
-                    "carbs": 65,
-                    "fat": 8,
-                },
-                "prep": (
-                    "Microwave oats with water or milk, then stir in "
-                    "whey protein and sliced banana."
-                ),
-            },
-            {
-                "name": "Fallback Lunch",
-                "ingredients": [
-                    "chicken breast (150g)",
-                    "rice (100g dry)",
-                    "mixed veggies (frozen, 100g)",
-                ],
-                "macros": {
-                    "kcal": 650,
-                    "protein": 55,
-                    "carbs": 75,
-                    "fat": 12,
-                },
-                "prep": (
-                    "Grill or pan-cook chicken, cook rice, heat veggies. "
-                    "Serve together and season to taste."
-                ),
-            },
-            {
-                "name": "Fallback Dinner",
-                "ingredients": [
-                    "93% lean ground turkey (150g)",
-                    "whole wheat pasta (90g dry)",
-                    "tomato sauce (100g)",
-                ],
-                "macros": {
-                    "kcal": 700,
-                    "protein": 55,
-                    "carbs": 80,
-                    "fat": 16,
-                },
-                "prep": (
-                    "Brown turkey in a pan, boil pasta, add tomato sauce. "
-                    "Combine and season with salt, pepper, and herbs."
-                ),
-            },
-        ],
-        "totals": totals,
-        "shopping_list": [
-            "rolled oats",
-            "whey protein",
-            "bananas",
-            "chicken breast",
-            "rice",
-            "mixed frozen veggies",
-            "93% lean ground turkey",
-            "whole wheat pasta",
-            "tomato sauce",
-        ],
-        "notes": (
-            "This is a static fallback plan used when the OpenAI API call "
-            "fails or is rate limited (HTTP 429). Once your OpenAI quota is "
-            "available again, the API will start returning fully "
-            "AI-generated plans instead."
-        ),
-    }
-    return plan
+
+def _invocation_deadline(context) -> float:
+    """
+    time.monotonic() value by which plan generation has to be done so the
+    handler can still answer before the Lambda times out.
+    """
+    if context is None:
+        return time.monotonic() + _OPENAI_DEADLINE
+    remaining = context.get_remaining_time_in_millis() / 1000
+    return time.monotonic() + remaining - _DEADLINE_MARGIN
 
 
-def call_openai_or_fallback(api_key: str, prompt: str, calories: int, protein_g: int) -> str:
+def call_openai_or_fallback(
+    api_key: str, prompt: str, calories: int, protein_g: int, deadline: float | None = None
+) -> str:
     """
     Try to call OpenAI. If anything goes wrong (HTTP error, network error, etc),
     log it and return a JSON string for a fallback plan instead.
+    Rate limits, 5xx and connection errors are retried with backoff first.
+    While the circuit breaker is open, OpenAI is skipped entirely.
+    deadline (a time.monotonic() value) bounds all attempts together.
     This function NEVER raises, so Lambda won't crash because of OpenAI.
     """
-    body = json.dumps(
-        {
-            "model": MODEL,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a nutrition planner. "
-                        "You ALWAYS respond with valid JSON only."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
+    if time.monotonic() < _BREAKER["open_until"]:
+        logger.warning("OpenAI circuit open, using fallback plan")
+        return _fallback_plan_json(calories, protein_g)
+
+    body = _BODY_HEAD + orjson.dumps(prompt) + _BODY_TAIL
+
+    call_deadline = time.monotonic() + _OPENAI_DEADLINE
+    deadline = call_deadline if deadline is None else min(deadline, call_deadline)
+
+    # Only rate limits, 5xx and connection errors say anything about OpenAI's
+    # health; bad requests (e.g. an over-long prompt) and refusals are
+    # per-request and must not open the breaker for everyone.
+    transient_failure = False
+
+    for attempt in range(_OPENAI_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        try:
+            r = _HTTP.request(
+                "POST",
+                OPENAI_PATH,
+                body=body,
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json",
                 },
-            ],
-            "response_format": {"type": "json_object"},
-            "temperature": 0.4,
-        }
-    ).encode("utf-8")
-
-    req = urllib.request.Request(
-        OPENAI_URL,
-        data=body,
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
+                timeout=urllib3.Timeout(
+                    connect=_OPENAI_CONNECT_TIMEOUT,
+                    read=_OPENAI_READ_TIMEOUT,
+                    total=remaining,
+                ),
+            )
+            if r.status == 200:
+                data = orjson.loads(r.data)
+                choice = data["choices"][0]
+                message = choice["message"]
+                content = message.get("content")
+                # A plan cut off by max_tokens (finish_reason "length") or
+                # refused by the model is unusable, and won't change on retry.
+                # The content is parsed once so only a complete JSON object is
+                # ever spliced into the response / stored in DynamoDB.
+                if choice.get("finish_reason") == "stop" and content:
+                    if isinstance(orjson.loads(content), dict):
+                        _BREAKER["fails"] = 0
+                        return content
+                logger.warning(
+                    "OpenAI returned no usable plan (finish_reason: %s, refusal: %s)",
+                    choice.get("finish_reason"),
+                    message.get("refusal"),
+                )
+                transient_failure = False
+                break
+            logger.warning("HTTPError from OpenAI: %s %s", r.status, r.reason)
+            transient_failure = r.status in _RETRYABLE_STATUS
+            if not transient_failure:
+                break
+        except urllib3.exceptions.HTTPError as e:
+            logger.warning("Connection error from OpenAI: %s", e)
+            transient_failure = True
+        except Exception as e:
+            logger.warning("Unexpected error when calling OpenAI: %s", e)
+            transient_failure = False
+            break
+
+        if attempt + 1 < _OPENAI_ATTEMPTS:
+            wait = random.uniform(0, _OPENAI_BACKOFF_BASE * 2 ** attempt)
+            if time.monotonic() + wait >= deadline:
+                break
+            time.sleep(wait)
+
+    # Any failure ends up here
+    if transient_failure:
+        _BREAKER["fails"] += 1
+        if _BREAKER["fails"] >= _BREAKER_THRESHOLD:
+            _BREAKER["open_until"] = time.monotonic() + _BREAKER_COOLDOWN
+            logger.warning("OpenAI circuit opened after %d failures", _BREAKER["fails"])
+
+    return _fallback_plan_json(calories, protein_g)
+
+
+class InvalidRequest(ValueError):
+    """
+    Request body that can't be used. Reported back to the caller without a
+    stack trace, since it's the client's fault and not worth logging as one.
+    """
+
+
+def _parse_body(raw_body: str) -> dict:
+    """
+    Parse a JSON request body, raising InvalidRequest unless it's an object.
+    """
+    try:
+        body = orjson.loads(raw_body)
+    except orjson.JSONDecodeError as e:
+        raise InvalidRequest(f"body is not valid JSON: {e}") from None
+    if not isinstance(body, dict):
+        raise InvalidRequest("body must be a JSON object")
+    return body
+
+
+def _as_int(value, default: int, maximum: int) -> int:
+    """
+    Lenient int coercion for numeric request fields: ints, finite floats and
+    decimal strings are accepted and clamped to [0, maximum], anything else
+    falls back to default.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return default
+    try:
+        number = int(value)
+    except (ValueError, OverflowError):
+        return default
+    return min(max(number, 0), maximum)
+
+
+def _generate_plan(body: dict, secret_future, deadline: float) -> str:
+    """
+    Build the prompt for a parsed request body and return the plan JSON
+    string from OpenAI (or the fallback). The API key is taken from
+    secret_future only once the prompt is ready; if it isn't there by
+    deadline, the fallback plan is returned.
+    """
+
+    calories = _as_int(body.get("calories"), 2000, MAX_CALORIES)
+    protein_g = _as_int(body.get("protein_g"), 180, MAX_PROTEIN_G)
+    dislikes = body.get("dislikes", ["pickles"])
+    budget = body.get("budget_per_day_usd", 8)
+
+    prompt = _PROMPT_TEMPLATE.format(
+        calories=calories, protein_g=protein_g, dislikes=dislikes, budget=budget
     )
 
-    ctx = ssl.create_default_context()
+    # Get API key and call OpenAI (or fallback)
+    try:
+        api_key = secret_future.result(timeout=max(deadline - time.monotonic(), 0))
+    except TimeoutError:
+        logger.warning("API key not available before the deadline, using fallback plan")
+        return _fallback_plan_json(calories, protein_g)
+    return call_openai_or_fallback(api_key, prompt, calories, protein_g, deadline)
+
+
+def _plan_item(plan_id: str, request_json: str, plan_json: str) -> dict:
+    """
+    DynamoDB item for a stored plan, marshalled with one shared
+    TypeSerializer so new attributes can be added as plain Python values.
+    """
+    serializer = _get_serializer()
+    item = {
+        "plan_id": plan_id,
+        "request": request_json,
+        "plan": plan_json,
+    }
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
 
+def _ddb_put(plan_id: str, request_json: str, plan_json: str) -> None:
+    """
+    Store the raw request body and plan JSON strings in DynamoDB.
+    Runs on _POOL, so errors are logged instead of raised.
+    """
     try:
-        with urllib.request.urlopen(req, context=ctx, timeout=12) as r:
-            data = json.loads(r.read().decode("utf-8"))
-            content = data["choices"][0]["message"]["content"]
-            return content
-    except HTTPError as e:
-        logger.warning("HTTPError from OpenAI: %s", e)
-    except URLError as e:
-        logger.warning("URLError from OpenAI: %s", e)
-    except Exception as e:
-        logger.warning("Unexpected error when calling OpenAI: %s", e)
+        _get_client("dynamodb").put_item(
+            TableName=os.environ["TABLE_NAME"],
+            Item=_plan_item(plan_id, request_json, plan_json),
+        )
+    except Exception:
+        logger.exception("Failed to store plan %s", plan_id)
 
-    # Any failure ends up here
-    fallback = build_fallback_plan(calories, protein_g)
-    return json.dumps(fallback)
+
+def _batch_write(items: list) -> list:
+    """
+    Write items with BatchWriteItem, _BATCH_WRITE_SIZE at a time.
+    UnprocessedItems are retried with exponential backoff + jitter; whatever
+    is still unprocessed after _BATCH_WRITE_ATTEMPTS is returned. If a call
+    raises, it is logged and only the items not yet written (the pending
+    request plus any chunks not started) are returned.
+    """
+    table = os.environ["TABLE_NAME"]
+    leftovers = []
+    it = iter(items)
+
+    while chunk := list(itertools.islice(it, _BATCH_WRITE_SIZE)):
+        request = {table: [{"PutRequest": {"Item": item}} for item in chunk]}
+        try:
+            for attempt in range(_BATCH_WRITE_ATTEMPTS):
+                resp = _get_client("dynamodb").batch_write_item(RequestItems=request)
+                request = resp.get("UnprocessedItems") or {}
+                if not request or attempt + 1 == _BATCH_WRITE_ATTEMPTS:
+                    break
+                time.sleep(random.uniform(0, _BATCH_WRITE_BACKOFF_BASE * 2 ** attempt))
+        except Exception:
+            logger.exception("BatchWriteItem failed")
+            leftovers.extend(r["PutRequest"]["Item"] for r in request.get(table, []))
+            leftovers.extend(it)
+            break
+        leftovers.extend(r["PutRequest"]["Item"] for r in request.get(table, []))
+
+    return leftovers
+
+
+def _wait_for_write(future, context) -> None:
+    """
+    Give a background write up to _DDB_WRITE_WAIT seconds (less if the
+    invocation is about to time out) before the response is returned.
+    """
+    timeout = _DDB_WRITE_WAIT
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000 - 0.2
+        timeout = min(timeout, max(remaining, 0))
+    try:
+        future.result(timeout=timeout)
+    except TimeoutError:
+        logger.warning("DynamoDB write still pending after %.2fs", timeout)
+
+
+def _record_id(record: dict) -> str | None:
+    """
+    batchItemFailures identifier of an SQS or Kinesis record, None for other
+    event sources (and anything that isn't a record at all).
+    """
+    if not isinstance(record, dict):
+        return None
+    kinesis = record.get("kinesis")
+    if isinstance(kinesis, dict):
+        return kinesis.get("sequenceNumber")
+    return record.get("messageId")
+
+
+def _record_body(record: dict) -> str:
+    """
+    JSON body of an SQS or Kinesis record. Kinesis data that isn't valid
+    base64 / UTF-8 raises InvalidRequest, as redelivery can't fix it either.
+    """
+    if "kinesis" in record:
+        try:
+            return base64.b64decode(record["kinesis"]["data"]).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError) as e:
+            raise InvalidRequest(f"record data can't be decoded: {e}") from None
+    return record.get("body") or "{}"
+
+
+def _flush_writes(pending: list) -> list:
+    """
+    BatchWriteItem the (record_id, item) pairs in pending and return the
+    batchItemFailures entries for records whose item wasn't written.
+    """
+    if not pending:
+        return []
+    items = [item for _, item in pending]
+    try:
+        unprocessed = _batch_write(items)
+    except Exception:
+        # Only raised before anything is sent (e.g. TABLE_NAME missing)
+        logger.exception("BatchWriteItem failed")
+        unprocessed = items
+
+    record_ids = {item["plan_id"]["S"]: record_id for record_id, item in pending}
+    return [{"itemIdentifier": record_ids[item["plan_id"]["S"]]} for item in unprocessed]
+
+
+def handle_records(records: list, context) -> dict:
+    """
+    Batch entrypoint for SQS / Kinesis triggers. Each record body has the same
+    shape as the API request body. Plans are stored with BatchWriteItem as
+    soon as _BATCH_WRITE_SIZE of them are ready, and failed records are
+    reported as batchItemFailures so only they are retried (records with an
+    unusable body are logged and dropped instead). Records are only
+    started while there's time left; the rest are reported for redelivery.
+    """
+    secret_future = _POOL.submit(get_secret, os.environ["OPENAI_PARAM"])
+
+    failures = []
+    pending = []
+
+    for index, record in enumerate(records):
+        record_id = _record_id(record)
+        if record_id is None:
+            source = record.get("eventSource") if isinstance(record, dict) else None
+            logger.warning("Skipping record from unsupported source %s", source)
+            continue
+
+        # Keep enough time after the last record to flush its write
+        deadline = _invocation_deadline(context) - _BATCH_WRITE_RESERVE
+        if deadline - time.monotonic() < _RECORD_MIN_TIME:
+            rest = [i for i in map(_record_id, records[index:]) if i is not None]
+            logger.warning("Out of time, leaving %d records for redelivery", len(rest))
+            failures.extend({"itemIdentifier": i} for i in rest)
+            break
+
+        try:
+            raw_body = _record_body(record)
+            plan_json_str = _generate_plan(_parse_body(raw_body), secret_future, deadline)
+        except InvalidRequest as e:
+            # Redelivery can't fix the body, so the record is dropped
+            logger.warning("Dropping record %s with invalid body: %s", record_id, e)
+            continue
+        except Exception:
+            logger.exception("Failed to build plan for record %s", record_id)
+            failures.append({"itemIdentifier": record_id})
+            continue
+
+        plan_id = os.urandom(16).hex()
+        pending.append((record_id, _plan_item(plan_id, raw_body, plan_json_str)))
+        if len(pending) == _BATCH_WRITE_SIZE:
+            failures.extend(_flush_writes(pending))
+            pending = []
+
+    failures.extend(_flush_writes(pending))
+    return {"batchItemFailures": failures}
 
 
 def lambda_handler(event, context):
@@ -192,67 +671,80 @@ def lambda_handler(event, context):
       - dislikes (list of strings)
       - budget_per_day_usd (float/int)
     This handler NEVER throws – it always returns a JSON body with statusCode 200.
+    SQS / Kinesis events (with "Records") are handed to handle_records.
     """
-    logger.info("Event: %s", json.dumps(event))
+    # Full events can be large (prompt text, headers), so only encode them
+    # when debug logging is actually on.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", orjson.dumps(event).decode("utf-8"))
+
+    # Anything that isn't a batch event goes down the API path, whose error
+    # handling turns malformed events into an error body.
+    if isinstance(event, dict) and isinstance(event.get("Records"), list):
+        records = event["Records"]
+        logger.info("Event received: %d records", len(records))
+        try:
+            return handle_records(records, context)
+        except Exception:
+            logger.exception("Unhandled exception in batch")
+            ids = [i for i in map(_record_id, records) if i is not None]
+            return {"batchItemFailures": [{"itemIdentifier": i} for i in ids]}
+
+    deadline = _invocation_deadline(context)
 
     try:
-        body = json.loads(event.get("body") or "{}")
-
-        calories = int(body.get("calories", 2000))
-        protein_g = int(body.get("protein_g", 180))
-        dislikes = body.get("dislikes", ["pickles"])
-        budget = body.get("budget_per_day_usd", 8)
-
-        prompt = (
-            f"Build a 1-day meal plan at about {calories} kcal and "
-            f"{protein_g} g protein. Avoid these foods: {dislikes}. "
-            f"Budget: ${budget} per day. "
-            "Return JSON with keys: "
-            "meals (array of {name, ingredients, macros:{kcal,protein,carbs,fat}, prep}), "
-            "totals ({kcal,protein,carbs,fat}), "
-            "shopping_list (array of strings), "
-            "notes (string)."
-        )
+        request_context = event.get("requestContext")
+        if not isinstance(request_context, dict):
+            request_context = {}
+        logger.info("Event received: requestId=%s", request_context.get("requestId"))
 
-        # Get API key and call OpenAI (or fallback)
-        api_key = get_secret(os.environ["OPENAI_PARAM"])
-        plan_json_str = call_openai_or_fallback(api_key, prompt, calories, protein_g)
+        # Parse first so malformed bodies never touch boto3 / SSM
+        raw_body = event.get("body") or "{}"
+        body = _parse_body(raw_body)
 
-        # Validate that the string is valid JSON
-        plan = json.loads(plan_json_str)
+        # Fetch the API key (SSM on a cold container) while the prompt is built
+        secret_future = _POOL.submit(get_secret, os.environ["OPENAI_PARAM"])
+        plan_json_str = _generate_plan(body, secret_future, deadline)
 
-        plan_id = str(uuid.uuid4())
-        DDB.put_item(
-            TableName=os.environ["TABLE_NAME"],
-            Item={
-                "plan_id": {"S": plan_id},
-                "request": {"S": json.dumps(body)},
-                "plan": {"S": json.dumps(plan)},
-            },
-        )
+        plan_id = os.urandom(16).hex()
+        write_future = _POOL.submit(_ddb_put, plan_id, raw_body, plan_json_str)
+        _wait_for_write(write_future, context)
 
-        resp_body = {
-            "plan_id": plan_id,
-            "plan": plan,
-            "source": "openai_or_fallback",
-        }
+        # plan_json_str is a validated JSON object (see call_openai_or_fallback),
+        # so it is spliced in as-is instead of being re-encoded.
+        resp_json = (
+            '{"plan_id":"' + plan_id + '","plan":' + plan_json_str
+            + ',"source":"openai_or_fallback"}'
+        )
 
+    except InvalidRequest as e:
+        logger.warning("Invalid request: %s", e)
+        resp_json = orjson.dumps(
+            {
+                "error": "invalid_request",
+                "detail": str(e),
+            }
+        ).decode("utf-8")
     except ClientError as e:
         logger.exception("AWS ClientError")
-        resp_body = {
-            "error": "AWS error",
-            "detail": str(e),
-        }
+        resp_json = orjson.dumps(
+            {
+                "error": "AWS error",
+                "detail": str(e),
+            }
+        ).decode("utf-8")
     except Exception as e:
         logger.exception("Unhandled exception in Lambda")
-        resp_body = {
-            "error": "internal_error",
-            "detail": str(e),
-        }
+        resp_json = orjson.dumps(
+            {
+                "error": "internal_error",
+                "detail": str(e),
+            }
+        ).decode("utf-8")
 
     # IMPORTANT: Always return 200 so API Gateway doesn't hide our error JSON
     return {
         "statusCode": 200,
         "headers": {"Content-Type": "application/json"},
-        "body": json.dumps(resp_body),
+        "body": resp_json,
     }
\ No newline at end of file